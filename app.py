@@ -1,18 +1,25 @@
 # mobile-backend/app.py
+import asyncio
 import os
-import secrets
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from enum import Enum
+from functools import lru_cache
+from typing import Annotated, Optional, List
 
-from fastapi import FastAPI, HTTPException, Query, status
+import orjson
+from bson import ObjectId
+from fastapi import FastAPI, HTTPException, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from pydantic import BaseModel, Field, confloat, conint
+from fastapi.responses import ORJSONResponse
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pydantic import BaseModel, ConfigDict, Field
 
 app = FastAPI(
     title="Shopokoa Mobile API",
     description="E-commerce backend API for mobile applications built with FastAPI",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # ==================== MongoDB Connection (LAZY + GRACEFUL) ====================
@@ -31,37 +38,39 @@ MONGODB_URI = os.getenv(
 
 # CORS Configuration - allow origins from environment variable or default to all for development
 # For mobile apps, you may want to keep allow_origins=["*"] or specify your mobile app domains
-allowed_origins = os.getenv(
-    "CORS_ORIGINS",
-    "*"  # Default to allow all for development
-).split(",")
+@lru_cache(maxsize=1)
+def get_cors_origins() -> List[str]:
+    allowed_origins = os.getenv(
+        "CORS_ORIGINS",
+        "*"  # Default to allow all for development
+    ).split(",")
+
+    # Remove empty strings and handle wildcard
+    if "*" in allowed_origins:
+        return ["*"]
+    return [origin.strip() for origin in allowed_origins if origin.strip()]
 
-# Remove empty strings and handle wildcard
-if "*" in allowed_origins:
-    cors_origins = ["*"]
-else:
-    cors_origins = [origin.strip() for origin in allowed_origins if origin.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=cors_origins,
+    allow_origins=get_cors_origins(),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-client: Optional[MongoClient] = None
+client: Optional[AsyncIOMotorClient] = None
 db = None
 products_collection = None
 orders_collection = None
 
 
-def get_db_client() -> MongoClient:
-    """Lazy-load the MongoDB client and test connection only once."""
+async def get_db_client() -> AsyncIOMotorClient:
+    """Lazy-load the async MongoDB client and test connection only once."""
     global client, db, products_collection, orders_collection
     if client is None:
         print("Creating MongoDB client...")
-        client = MongoClient(
+        client = AsyncIOMotorClient(
             MONGODB_URI,
             tls=True,
             tlsCAFile="global-bundle.pem",           # Make sure this file is in project root
@@ -70,10 +79,16 @@ def get_db_client() -> MongoClient:
             directConnection=True,
             serverSelectionTimeoutMS=10000,
             connectTimeoutMS=10000,
+            maxPoolSize=200,
+            minPoolSize=20,
+            maxIdleTimeMS=60000,
+            waitQueueTimeoutMS=5000,
         )
-        # Test connection (non-blocking for the app startup)
+        # Test connection and pre-warm the pool (non-blocking for the app startup)
+        # Concurrent pings force minPoolSize connections to complete their TLS
+        # handshakes now rather than on the first traffic burst.
         try:
-            client.admin.command("ping")
+            await asyncio.gather(*[client.admin.command("ping") for _ in range(20)])
             print("Successfully connected to Amazon DocumentDB! 🚀")
         except Exception as e:
             print("⚠️ DocumentDB not reachable yet:", e)
@@ -86,17 +101,69 @@ def get_db_client() -> MongoClient:
     return client
 
 
-# Call it once at startup (won't crash the app)
-get_db_client()
+# Coarse "current time" refreshed by a background task. Timestamps like
+# createdAt/updatedAt and the health check only need ~second granularity,
+# so hot paths read this global instead of allocating a new datetime.
+_NOW = datetime.utcnow()
+
+# Pre-serialized /health body; only the timestamp ever changes, so the
+# clock task splices it in and the handlers return the cached bytes.
+_HEALTH_PREFIX = b'{"status":"healthy","service":"mobile-api","timestamp":"'
+_HEALTH_SUFFIX = b'"}'
+_HEALTH_BODY = _HEALTH_PREFIX + _NOW.isoformat().encode() + _HEALTH_SUFFIX
+
+# Keep a reference to the clock task so it isn't garbage-collected mid-flight
+# and can be cancelled cleanly at shutdown
+_clock_task: Optional[asyncio.Task] = None
+
+
+async def _refresh_clock():
+    global _NOW, _HEALTH_BODY
+    while True:
+        _NOW = datetime.utcnow()
+        _HEALTH_BODY = _HEALTH_PREFIX + _NOW.isoformat().encode() + _HEALTH_SUFFIX
+        await asyncio.sleep(0.1)
+
+
+async def ensure_indexes():
+    """Create the indexes backing the query/sort patterns the routes use."""
+    # products: lookup by id, filter by category
+    # orders: lookup by orderId, filter by status sorted by newest first
+    await asyncio.gather(
+        products_collection.create_index("id", unique=True, background=True),
+        products_collection.create_index("category", background=True),
+        orders_collection.create_index("orderId", unique=True, background=True),
+        orders_collection.create_index(
+            [("status", 1), ("createdAt", -1)], background=True
+        ),
+    )
+
+
+# Create the client once the event loop is running (won't crash the app)
+@app.on_event("startup")
+async def startup_db_client():
+    global _clock_task
+    _clock_task = asyncio.create_task(_refresh_clock())
+    await get_db_client()
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        print("⚠️ Could not create indexes:", e)
+
+
+@app.on_event("shutdown")
+async def shutdown_clock_task():
+    if _clock_task is not None:
+        _clock_task.cancel()
 
 
 # ==================== Pydantic Models ====================
 class ProductBase(BaseModel):
     name: str
     description: Optional[str] = None
-    price: confloat(gt=0)
+    price: Annotated[float, Field(gt=0)]
     category: str
-    stock: conint(ge=0) = 0
+    stock: Annotated[int, Field(ge=0)] = 0
     image: Optional[str] = None
     brand: Optional[str] = "Generic"
 
@@ -108,9 +175,9 @@ class ProductCreate(ProductBase):
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
-    price: Optional[confloat(gt=0)] = None
+    price: Optional[Annotated[float, Field(gt=0)]] = None
     category: Optional[str] = None
-    stock: Optional[conint(ge=0)] = None
+    stock: Optional[Annotated[int, Field(ge=0)]] = None
     image: Optional[str] = None
 
 
@@ -121,13 +188,12 @@ class ProductInDB(ProductBase):
     createdAt: datetime
     updatedAt: datetime
 
-    class Config:
-        populate_by_name = True
+    model_config = ConfigDict(populate_by_name=True)
 
 
 class OrderItem(BaseModel):
     productId: str
-    quantity: conint(gt=0)
+    quantity: Annotated[int, Field(gt=0)]
 
 
 class ShippingAddress(BaseModel):
@@ -140,7 +206,7 @@ class ShippingAddress(BaseModel):
 
 class OrderCreate(BaseModel):
     items: List[OrderItem]
-    total: confloat(gt=0)
+    total: Annotated[float, Field(gt=0)]
     customerName: str = "Guest"
     customerEmail: Optional[str] = None
     shippingAddress: ShippingAddress
@@ -158,85 +224,99 @@ class OrderInDB(BaseModel):
     updatedAt: datetime
 
 
+class OrderStatus(str, Enum):
+    pending = "pending"
+    processing = "processing"
+    shipped = "shipped"
+    delivered = "delivered"
+    cancelled = "cancelled"
+
+
 class OrderStatusUpdate(BaseModel):
-    status: str = Field(..., pattern="^(pending|processing|shipped|delivered|cancelled)$")
+    status: OrderStatus
 
 
 # ==================== Dummy Data Fallback ====================
-def get_dummy_products() -> List[Dict[str, Any]]:
-    return [
-        {
-            "id": "1",
-            "name": "Laptop Pro",
-            "description": "High-performance laptop for professionals",
-            "price": 1299.99,
-            "category": "Electronics",
-            "stock": 15,
-            "image": "https://via.placeholder.com/300x300?text=Laptop",
-            "rating": 4.8,
-            "reviews": 127,
-            "brand": "ProBook",
-            "createdAt": datetime.utcnow().isoformat(),
-            "updatedAt": datetime.utcnow().isoformat(),
-        },
-        {
-            "id": "2",
-            "name": "Wireless Mouse",
-            "description": "Ergonomic wireless mouse",
-            "price": 29.99,
-            "category": "Accessories",
-            "stock": 50,
-            "image": "https://via.placeholder.com/300x300?text=Mouse",
-            "rating": 4.5,
-            "reviews": 89,
-            "brand": "LogiTech",
-            "createdAt": datetime.utcnow().isoformat(),
-            "updatedAt": datetime.utcnow().isoformat(),
-        },
-        {
-            "id": "3",
-            "name": "USB-C Hub",
-            "description": "7-in-1 USB-C hub adapter",
-            "price": 49.99,
-            "category": "Accessories",
-            "stock": 30,
-            "image": "https://via.placeholder.com/300x300?text=Hub",
-            "rating": 4.6,
-            "reviews": 201,
-            "brand": "Anker",
-            "createdAt": datetime.utcnow().isoformat(),
-            "updatedAt": datetime.utcnow().isoformat(),
-        },
-    ]
+# Built once at import; the fallback path serves the pre-serialized blob
+# instead of rebuilding dicts and timestamps on every request.
+_DUMMY_TIMESTAMP = datetime.utcnow().isoformat()
+
+_DUMMY_PRODUCTS: tuple = (
+    {
+        "id": "1",
+        "name": "Laptop Pro",
+        "description": "High-performance laptop for professionals",
+        "price": 1299.99,
+        "category": "Electronics",
+        "stock": 15,
+        "image": "https://via.placeholder.com/300x300?text=Laptop",
+        "rating": 4.8,
+        "reviews": 127,
+        "brand": "ProBook",
+        "createdAt": _DUMMY_TIMESTAMP,
+        "updatedAt": _DUMMY_TIMESTAMP,
+    },
+    {
+        "id": "2",
+        "name": "Wireless Mouse",
+        "description": "Ergonomic wireless mouse",
+        "price": 29.99,
+        "category": "Accessories",
+        "stock": 50,
+        "image": "https://via.placeholder.com/300x300?text=Mouse",
+        "rating": 4.5,
+        "reviews": 89,
+        "brand": "LogiTech",
+        "createdAt": _DUMMY_TIMESTAMP,
+        "updatedAt": _DUMMY_TIMESTAMP,
+    },
+    {
+        "id": "3",
+        "name": "USB-C Hub",
+        "description": "7-in-1 USB-C hub adapter",
+        "price": 49.99,
+        "category": "Accessories",
+        "stock": 30,
+        "image": "https://via.placeholder.com/300x300?text=Hub",
+        "rating": 4.6,
+        "reviews": 201,
+        "brand": "Anker",
+        "createdAt": _DUMMY_TIMESTAMP,
+        "updatedAt": _DUMMY_TIMESTAMP,
+    },
+)
+
+_DUMMY_PRODUCTS_JSON = orjson.dumps(list(_DUMMY_PRODUCTS))
 
 
 # ==================== Routes ====================
 @app.get("/health", tags=["Health"])
 async def health_check():
-    return {"status": "healthy", "service": "mobile-api", "timestamp": datetime.utcnow().isoformat()}
+    return Response(_HEALTH_BODY, media_type="application/json")
 
 @app.get("/api/mobile/health", tags=["Health"])
 async def health_check():
-    return {"status": "healthy", "service": "mobile-api", "timestamp": datetime.utcnow().isoformat()}
+    return Response(_HEALTH_BODY, media_type="application/json")
 
 # ------------------- Products -------------------
 @app.get("/api/mobile/products", response_model=List[ProductInDB], tags=["Products"])
 async def get_products(category: Optional[str] = Query(None)):
+    """List products for the mobile catalogue view.
+
+    The list view omits `description` to cut bytes over the wire; clients
+    fetch the full document from GET /api/mobile/products/{product_id}.
+    """
     query = {"category": category} if category else {}
     try:
-        products = list(products_collection.find(query, {"_id": 0}))
+        products = await products_collection.find(
+            query, {"_id": 0, "description": 0}
+        ).to_list(length=None)
     except Exception as e:
         print("DB error, falling back to dummy products:", e)
         products = []
 
     if not products:
-        products = get_dummy_products()
-
-    # Serialize datetime fields
-    for p in products:
-        for field in ["createdAt", "updatedAt"]:
-            if field in p and isinstance(p[field], datetime):
-                p[field] = p[field].isoformat()
+        return Response(_DUMMY_PRODUCTS_JSON, media_type="application/json")
 
     return products
 
@@ -244,76 +324,61 @@ async def get_products(category: Optional[str] = Query(None)):
 @app.get("/api/mobile/products/{product_id}", tags=["Products"])
 async def get_product(product_id: str):
     try:
-        product = products_collection.find_one({"id": product_id}, {"_id": 0})
+        product = await products_collection.find_one({"id": product_id}, {"_id": 0})
     except Exception:
         product = None
 
     if not product:
         # Fallback to dummy if ID matches
-        dummy = next((p for p in get_dummy_products() if p["id"] == product_id), None)
+        dummy = next((p for p in _DUMMY_PRODUCTS if p["id"] == product_id), None)
         if dummy:
             return dummy
         raise HTTPException(status_code=404, detail="Product not found")
 
-    for field in ["createdAt", "updatedAt"]:
-        if isinstance(product.get(field), datetime):
-            product[field] = product[field].isoformat()
     return product
 
 
 @app.post("/api/mobile/products", status_code=status.HTTP_201_CREATED, response_model=ProductInDB, tags=["Products"])
 async def create_product(product: ProductCreate):
-    if not products_collection:
+    if products_collection is None:
         raise HTTPException(status_code=503, detail="Database not available")
 
-    product_id = secrets.token_hex(4)
-    new_product = product.dict()
+    product_id = str(ObjectId())
+    new_product = product.model_dump()
     new_product.update({
         "id": product_id,
         "rating": 0.0,
         "reviews": 0,
-        "createdAt": datetime.utcnow(),
-        "updatedAt": datetime.utcnow(),
+        "createdAt": _NOW,
+        "updatedAt": _NOW,
     })
 
-    products_collection.insert_one(new_product)
-    new_product["createdAt"] = new_product["createdAt"].isoformat()
-    new_product["updatedAt"] = new_product["updatedAt"].isoformat()
+    await products_collection.insert_one(new_product)
     return new_product
 
 
 @app.put("/api/mobile/products/{product_id}", response_model=ProductInDB, tags=["Products"])
 async def update_product(product_id: str, product_update: ProductUpdate):
-    update_data = product_update.dict(exclude_unset=True)
+    update_data = product_update.model_dump(exclude_unset=True)
     if "updatedAt" not in update_data:
-        update_data["updatedAt"] = datetime.utcnow()
-
-    if not update_data.keys() - {"updatedAt"}:  # only updatedAt was set
-        updated_product = products_collection.find_one({"id": product_id}, {"_id": 0})
-        if not updated_product:
-            raise HTTPException(status_code=404, detail="Product not found")
-    else:
-        result = products_collection.update_one(
-            {"id": product_id},
-            {"$set": update_data}
-        )
+        update_data["updatedAt"] = _NOW
 
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Product not found")
-
-        updated_product = products_collection.find_one({"id": product_id}, {"_id": 0})
+    updated_product = await products_collection.find_one_and_update(
+        {"id": product_id},
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
 
-    # Serialize datetimes
-    for field in ["createdAt", "updatedAt"]:
-        if isinstance(updated_product.get(field), datetime):
-            updated_product[field] = updated_product[field].isoformat()
+    if not updated_product:
+        raise HTTPException(status_code=404, detail="Product not found")
 
     return updated_product
 
 
 @app.delete("/api/mobile/products/{product_id}", tags=["Products"])
 async def delete_product(product_id: str):
-    result = products_collection.delete_one({"id": product_id})
+    result = await products_collection.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
     return {"message": "Product deleted successfully"}
@@ -323,9 +388,22 @@ async def delete_product(product_id: str):
 
 @app.post("/api/mobile/orders", status_code=status.HTTP_201_CREATED, response_model=OrderInDB, tags=["Orders"])
 async def create_order(order: OrderCreate):
-    # Validate stock
+    # Bind the collections to locals once; the handler touches them repeatedly
+    products_coll = products_collection
+    orders_coll = orders_collection
+
+    # Validate stock first (single round-trip for all items) so the everyday
+    # failures — unknown product, not enough stock — reject without touching
+    # inventory at all.
+    ids = [item.productId for item in order.items]
+    products = {
+        p["id"]: p
+        async for p in products_coll.find(
+            {"id": {"$in": ids}}, {"id": 1, "stock": 1, "name": 1}
+        )
+    }
     for item in order.items:
-        product = products_collection.find_one({"id": item.productId})
+        product = products.get(item.productId)
         if not product:
             raise HTTPException(
                 status_code=404,
@@ -337,35 +415,51 @@ async def create_order(order: OrderCreate):
                 detail=f"Insufficient stock for {product['name']}"
             )
 
-    order_id = f"ORD{int(datetime.utcnow().timestamp())}"
+    # Decrement with a stock >= quantity guard to absorb the race where a
+    # concurrent order drained stock since validation. The updates run as
+    # individual (parallel) ops so each item's outcome is known and any that
+    # landed can be rolled back if another one lost the race.
+    now = _NOW
+    results = await asyncio.gather(*[
+        products_coll.update_one(
+            {"id": item.productId, "stock": {"$gte": item.quantity}},
+            {
+                "$inc": {"stock": -item.quantity},
+                "$set": {"updatedAt": now}
+            }
+        )
+        for item in order.items
+    ])
+
+    failed = [item for item, r in zip(order.items, results) if r.modified_count == 0]
+    if failed:
+        # Compensate the decrements that did land, then reject the order
+        succeeded = [item for item, r in zip(order.items, results) if r.modified_count > 0]
+        if succeeded:
+            await products_coll.bulk_write([
+                UpdateOne(
+                    {"id": item.productId},
+                    {"$inc": {"stock": item.quantity}, "$set": {"updatedAt": now}}
+                )
+                for item in succeeded
+            ], ordered=False)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient stock for {products[failed[0].productId]['name']}"
+        )
+
+    order_id = str(ObjectId())
 
+    # One model_dump covers items and shippingAddress in a single Rust pass
     new_order = {
         "orderId": order_id,
-        "items": [item.dict() for item in order.items],
-        "total": order.total,
-        "customerName": order.customerName,
-        "customerEmail": order.customerEmail,
-        "shippingAddress": order.shippingAddress.dict(),
+        **order.model_dump(),
         "status": "pending",
-        "createdAt": datetime.utcnow(),
-        "updatedAt": datetime.utcnow(),
+        "createdAt": _NOW,
+        "updatedAt": _NOW,
     }
 
-    orders_collection.insert_one(new_order)
-
-    # Decrease stock
-    for item in order.items:
-        products_collection.update_one(
-            {"id": item.productId},
-            {
-                "$inc": {"stock": -item.quantity},
-                "$set": {"updatedAt": datetime.utcnow()}
-            }
-        )
-
-    # Serialize for response
-    new_order["createdAt"] = new_order["createdAt"].isoformat()
-    new_order["updatedAt"] = new_order["updatedAt"].isoformat()
+    await orders_coll.insert_one(new_order)
 
     return new_order
 
@@ -373,80 +467,83 @@ async def create_order(order: OrderCreate):
 @app.get("/api/mobile/orders", response_model=List[OrderInDB], tags=["Orders"])
 async def get_orders(limit: int = Query(10, le=100), status_filter: Optional[str] = Query(None, alias="status")):
     query = {"status": status_filter} if status_filter else {}
-    orders = list(
+    orders = await (
         orders_collection.find(query, {"_id": 0})
         .sort("createdAt", -1)
-        .limit(limit))
-
-    # Serialize datetimes
-    for o in orders:
-        for field in ["createdAt", "updatedAt"]:
-            if isinstance(o.get(field), datetime):
-                o[field] = o[field].isoformat()
+        .limit(limit)
+        .to_list(length=limit))
 
     return orders
 
 
+# Registered before /orders/{order_id} so "stats" isn't swallowed as an ID
+@app.get("/api/mobile/orders/stats", tags=["Orders"])
+async def get_order_stats():
+    # Grouped stats and the total count in one $facet round-trip
+    pipeline = [
+        {
+            "$facet": {
+                "stats": [
+                    {
+                        "$group": {
+                            "_id": "$status",
+                            "count": {"$sum": 1},
+                            "totalRevenue": {"$sum": "$total"}
+                        }
+                    }
+                ],
+                "total": [{"$count": "n"}]
+            }
+        }
+    ]
+
+    result = (await orders_collection.aggregate(pipeline).to_list(length=1))[0]
+    total = result["total"]
+
+    return {
+        "stats": result["stats"],
+        "totalOrders": total[0]["n"] if total else 0
+    }
+
+
 @app.get("/api/mobile/orders/{order_id}", response_model=OrderInDB, tags=["Orders"])
 async def get_order(order_id: str):
-    order = orders_collection.find_one({"orderId": order_id}, {"_id": 0})
+    order = await orders_collection.find_one({"orderId": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    for field in ["createdAt", "updatedAt"]:
-        if isinstance(order.get(field), datetime):
-            order[field] = order[field].isoformat()
-
     return order
 
 
 @app.patch("/api/mobile/orders/{order_id}/status", response_model=OrderInDB, tags=["Orders"])
 async def update_order_status(order_id: str, payload: OrderStatusUpdate):
-    result = orders_collection.update_one(
+    updated_order = await orders_collection.find_one_and_update(
         {"orderId": order_id},
         {
             "$set": {
-                "status": payload.status,
-                "updatedAt": datetime.utcnow()
+                "status": payload.status.value,
+                "updatedAt": _NOW
             }
-        }
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
     )
 
-    if result.matched_count == 0:
+    if not updated_order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    updated_order = orders_collection.find_one({"orderId": order_id}, {"_id": 0})
-
-    for field in ["createdAt", "updatedAt"]:
-        if isinstance(updated_order.get(field), datetime):
-            updated_order[field] = updated_order[field].isoformat()
-
     return updated_order
 
 
-@app.get("/api/mobile/orders/stats", tags=["Orders"])
-async def get_order_stats():
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$status",
-                "count": {"$sum": 1},
-                "totalRevenue": {"$sum": "$total"}
-            }
-        }
-    ]
-
-    stats = list(orders_collection.aggregate(pipeline))
-    total_orders = orders_collection.count_documents({})
-
-    return {
-        "stats": stats,
-        "totalOrders": total_orders
-    }
-
-
 # Run with: uvicorn app:app --host 0.0.0.0 --port 5002 --reload (for dev)
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 5002))
-    uvicorn.run("app:app", host="0.0.0.0", port=port, reload=False)
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", os.cpu_count())),
+    )